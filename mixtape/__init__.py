@@ -0,0 +1,20 @@
+#
+# mixtape - library behind musicmaker2.py: read playlists, plan and
+# name target files, and copy/convert them for less capable players.
+#
+# Pieces:
+# * sources - playlist readers (m3u, Rhythmbox, filesystem)
+# * planner - work out target names and what to copy or convert
+# * executor - copy/convert planned items, locally or on workers
+# * sync - all of the above in one call, as the CLI does it
+# * cli - the musicmaker2.py command line
+#
+# Only what a given run needs gets imported: defusedxml for Rhythmbox
+# playlists, SQLite for the fs catalog and loudness cache, and the
+# networking bits for workers. Caches stay warm in-process between
+# sync() calls.
+#
+# Nick Phillips <nwp@zepler.net>
+#
+
+from .sync import sync, SyncError
@@ -0,0 +1,152 @@
+#
+# The musicmaker2.py command line.
+#
+
+import argparse
+import sys
+
+from .converters import open_log, close_log
+from .sync import sync, SyncError, cache_path
+from .executor import report
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Convert a playlist to desired format')
+    parser.add_argument('pl_names', metavar='playlist', type=str, nargs='*',
+                        help='Names of playlists to copy/transcode')
+    parser.add_argument('-T', '--type', dest='type', type=str, default='m3u',
+                        help='Playlist type - m3u (m3u files), rb (Rhythmbox), fs (filesystem paths)')
+    parser.add_argument('-t', '--target', dest='target', type=str, default=None,
+                        help='Target directory')
+    parser.add_argument('-s', '--single', dest='single', action='store_true', default=False,
+                        help='Store all files within a single directory (target). '
+                             'Takes precedence over -n option')
+    parser.add_argument('-n', '--named', dest='named', action='store_true', default=False,
+                        help='Store all files within each playlist under a single '
+                             'directory named as the playlist, under target')
+    parser.add_argument('-N', '--number', dest='number', action='store_true', default=False,
+                        help='With -s or -n, prefix all output filenames with a number'
+                             'indicating ordering within the input playlist(s)')
+    parser.add_argument('-p', '--profile', dest='profile', type=str, default="mp3",
+                        help='Target encoding profile')
+    parser.add_argument('-r', '--recode', dest='recode', action='store_true', default=False,
+                        help='Recode files already using the target format')
+    parser.add_argument('-m', '--mangle', dest='mangle', action='store_true', default=False,
+                        help='Mangle possibly-problematic characters in filenames '
+                             '(e.g. if target is a FAT-based filesystem)')
+    parser.add_argument('-f', '--force', dest='force', action='store_true', default=False,
+                        help='Continue working if target not empty')
+    parser.add_argument('-x', '--translatefrom', dest='translatefrom', type=str, default=None,
+                        help='Path translation original')
+    parser.add_argument('-y', '--translateto', dest='translateto', type=str, default=None,
+                        help='Path translation modified')
+    parser.add_argument('-o', '--origin', dest='origin', type=str, default=None,
+                        help='Origin of playlists (file or dir path depending on playlist type)')
+    parser.add_argument('-C', '--catalog', dest='catalog', type=str, default=None,
+                        help='With fs type, keep directory listings in this SQLite file and '
+                             'only re-read directories whose mtime has changed since last run')
+    parser.add_argument('-G', '--gaincache', dest='gaincache', type=str,
+                        default=cache_path('loudness.db'),
+                        help='SQLite file caching measured loudness by file content, '
+                             'for profiles that normalise or tag loudness')
+    parser.add_argument('-b', '--batch', dest='batch', type=int, default=1,
+                        help='Convert up to BATCH files per avconv/ffmpeg process to save on '
+                             'encoder startup (prefers avconv/ffmpeg over sox where they can '
+                             'handle the file)')
+    parser.add_argument('-l', '--log', dest='log', type=str, default=cache_path('converters.log'),
+                        help='File to log converter output to, a new one each run with '
+                             'the last few kept. Error reports only show the end of the '
+                             'output. Empty for no log')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        help='Run up to JOBS conversions at once (0 for one per CPU)')
+    parser.add_argument('-L', '--load-aware', dest='loadaware', action='store_true', default=False,
+                        help='Run fewer than JOBS conversions at once while the machine is '
+                             'busy, going by CPU pressure (PSI) or else load average')
+    parser.add_argument('--nice', dest='nice', type=int, default=None,
+                        help='Run converters at this niceness')
+    parser.add_argument('--ionice', dest='ionice', type=str, default=None,
+                        help='Run converters with this I/O scheduling CLASS[:LEVEL], '
+                             'as for ionice(1) (e.g. idle, or best-effort:7)')
+    parser.add_argument('--timeout', dest='timeout', type=int, default=None,
+                        help='Kill a converter that takes longer than this many seconds '
+                             'per file. Also sent to workers (-w), which use the lower of '
+                             'this and their own --timeout')
+    parser.add_argument('-S', '--synofix', dest='synofix', action='store_true', default=False,
+                        help='Mangle paths from m3u files to work around bug in Synology AudioStation')
+    parser.add_argument('-w', '--workers', dest='workers', type=str, action='append', default=[],
+                        help='HOST:PORT of a worker to farm conversions out to. May be given '
+                             'more than once; give a worker more than once to run several '
+                             'conversions on it at a time. Conversions still run here too, '
+                             'as set by -j, -L and -b')
+    parser.add_argument('--shared', dest='shared', action='store_true', default=False,
+                        help='With -w, send workers source paths (which they may translate with '
+                             'their own -x/-y) instead of streaming the source files')
+    parser.add_argument('--worker', dest='worker', action='store_true', default=False,
+                        help='Run as a worker, converting files for a coordinator (see -w). '
+                             'Only -x/-y (applied to --shared paths), -l, --nice, --ionice '
+                             'and --timeout are used. '
+                             'Workers read any local file they are sent the path of, so only '
+                             'listen on trusted networks')
+    parser.add_argument('--listen', dest='listen', type=str, default=None,
+                        help='[HOST:]PORT for --worker to listen on. HOST defaults to '
+                             'localhost; give one (e.g. 0.0.0.0) to take work from other '
+                             'machines')
+    #parser.add_argument('-i', '--input-encoding', dest='iconvin', type=str, default='utf-8',
+    #                    help='Input (playlist) character encoding')
+    #parser.add_argument('--output-encoding', dest='iconvout', type=str, default='utf-8',
+    #                    help='Output (file naming) character encoding')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        if args.listen is None:
+            parser.error('--worker requires --listen')
+        if args.timeout is not None and args.timeout <= 0:
+            parser.error('--timeout must be more than 0')
+    else:
+        if not args.pl_names:
+            parser.error('at least one playlist is required')
+        if args.target is None:
+            parser.error('the following arguments are required: -t/--target')
+
+    if args.log:
+        open_log(args.log)
+    else:
+        close_log()
+
+    workers = []
+    if args.worker or args.workers:
+        from .remote import parse_address, serve_worker
+        try:
+            workers = [parse_address(w, 'localhost') for w in args.workers]
+            listen = parse_address(args.listen, 'localhost') if args.listen is not None else None
+        except ValueError:
+            sys.stderr.write("ERROR: worker addresses must be [HOST:]PORT\n")
+            return 1
+        if args.worker:
+            serve_worker(listen, args.translatefrom, args.translateto, {
+                'nice': args.nice,
+                'ionice': args.ionice,
+                'timeout': args.timeout,
+            })
+            return 0
+
+    try:
+        errors = sync(args.pl_names, args.target, type=args.type, origin=args.origin,
+                      profile=args.profile, single=args.single, named=args.named,
+                      number=args.number, recode=args.recode, mangle=args.mangle,
+                      force=args.force, translatefrom=args.translatefrom,
+                      translateto=args.translateto, synofix=args.synofix,
+                      catalog=args.catalog, gaincache=args.gaincache, batch=args.batch,
+                      workers=workers, shared=args.shared, jobs=args.jobs,
+                      loadaware=args.loadaware, nice=args.nice, ionice=args.ionice,
+                      timeout=args.timeout)
+    except SyncError as e:
+        sys.stderr.write("ERROR: {err}\n".format(err=e))
+        return 1
+    report(errors)
+    return 0
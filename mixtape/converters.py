@@ -0,0 +1,419 @@
+#
+# Converters, what they can handle and the encoding profiles, plus
+# running them on single items and batches.
+#
+
+import logging
+import logging.handlers
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+# Converter output goes to this logger as it arrives (see open_log); only
+# the last TAIL_BYTES of each of stdout/stderr is kept for error reports.
+log = logging.getLogger(__name__)
+
+TAIL_BYTES = 4096
+# Handler added by open_log, if any
+loghandler = None
+
+# Longest line to hold back waiting for its end. ffmpeg's progress
+# lines end in \r, and some output has no line ends at all.
+LINE_BYTES = 65536
+# How long to wait for output after killing a converter's process group
+KILL_GRACE = 5
+
+preference = ['sox', 'avconv', 'ffmpeg']
+
+# Converters able to take several inputs/outputs in one process
+batchable = ['avconv', 'ffmpeg']
+
+# Output formats for which sox's comments end up as real tags (Vorbis
+# comments). Its MP3 writer only maps a few known names to ID3.
+sox_tags = set([
+    'ogg',
+    'oga',
+    'flac',
+    ])
+
+handlers = {
+    'sox': set([
+            'mp3',
+            'ogg',
+            'oga',
+            'flac',
+            'wav',
+            'aiff',
+            'au',
+            ]),
+    'avconv': set([
+            'mp3',
+            'ogg',
+            'oga',
+            'flac',
+            'wav',
+            'aac',
+            'aiff',
+            'au',
+            'm4a',
+            ]),
+    'ffmpeg': set([
+            'mp3',
+            'ogg',
+            'oga',
+            'flac',
+            'wav',
+            'aac',
+            'aiff',
+            'au',
+            'm4a',
+            ]),
+    }
+    
+profiles = {
+    'mp3': {
+        'ext': 'mp3',
+        'avconv': ['-id3v2_version', '3'],
+        },
+    'mp3-hiq': {
+        'ext': 'mp3',
+        'sox': ['-t', 'mp3', '-C', '0'],
+        'avconv': ['-q:a', '0', '-id3v2_version', '3'],
+        },
+    'ogg': {
+        'ext': 'ogg',
+        },
+    # 'loudness' is a target in LUFS: gain is applied while encoding,
+    # or with 'replaygain' just written to ReplayGain tags (-18 LUFS
+    # is the ReplayGain 2 reference level). With -n, each playlist
+    # gets album gain rather than track gain.
+    'mp3-norm': {
+        'ext': 'mp3',
+        'avconv': ['-id3v2_version', '3'],
+        'loudness': -16.0,
+        },
+    'mp3-rg': {
+        'ext': 'mp3',
+        'avconv': ['-id3v2_version', '3'],
+        'loudness': -18.0,
+        'replaygain': True,
+        },
+    'ogg-rg': {
+        'ext': 'ogg',
+        'loudness': -18.0,
+        'replaygain': True,
+        },
+}
+
+class UnknownConverter(Exception):
+    pass
+
+extensions = set()
+for handler in handlers.values():
+    extensions.update(handler)
+
+def gain_args(item, converter, profile):
+    # Returns (options before target, effects after target) to apply or
+    # tag the item's gain. Only sox takes effects after the target.
+    gain = item.get('gain')
+    if gain is None:
+        return ([], [])
+    if profile.get('replaygain'):
+        tags = [
+            ('REPLAYGAIN_TRACK_GAIN', '%.2f dB' % gain['track_gain']),
+            ('REPLAYGAIN_TRACK_PEAK', '%.6f' % gain['track_peak']),
+        ]
+        if 'album_gain' in gain:
+            tags.extend([
+                ('REPLAYGAIN_ALBUM_GAIN', '%.2f dB' % gain['album_gain']),
+                ('REPLAYGAIN_ALBUM_PEAK', '%.6f' % gain['album_peak']),
+            ])
+        before = []
+        for (tag, value) in tags:
+            if converter == 'sox':
+                before.extend(['--add-comment', '%s=%s' % (tag, value)])
+            else:
+                before.extend(['-metadata', '%s=%s' % (tag, value)])
+        return (before, [])
+    if converter == 'sox':
+        return ([], ['gain', '%.2f' % gain['apply']])
+    return (['-af', 'volume=%.2fdB' % gain['apply']], [])
+
+
+def open_log(path, maxbytes=10 * 1024 * 1024, backups=5):
+    # Log converter output to path, starting a new file for this run
+    # and keeping the last few runs' files. Replaces any log opened
+    # before, so a long-lived process can call this for each run.
+    global loghandler
+    close_log()
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=maxbytes, backupCount=backups)
+    if os.path.getsize(path):
+        handler.doRollover()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+    loghandler = handler
+    return handler
+
+
+def close_log():
+    global loghandler
+    if loghandler is not None:
+        log.removeHandler(loghandler)
+        loghandler.close()
+        loghandler = None
+
+
+def capture(stream, name, pid, tail):
+    # Read stream to EOF, logging it line by line and keeping its tail
+    partial = b''
+    while True:
+        chunk = os.read(stream.fileno(), 65536)
+        if not chunk:
+            break
+        tail.extend(chunk)
+        del tail[:-TAIL_BYTES]
+        lines = (partial + chunk).replace(b'\r', b'\n').split(b'\n')
+        partial = lines.pop()
+        if len(partial) > LINE_BYTES:
+            lines.append(partial)
+            partial = b''
+        for line in lines:
+            if line:
+                log.info("[%d %s] %s", pid, name, line.decode('utf-8', errors='replace'))
+    if partial:
+        log.info("[%d %s] %s", pid, name, partial.decode('utf-8', errors='replace'))
+    stream.close()
+
+
+def killgroup(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.wait()
+
+
+def run_converter(cmd, limits=None, items=1):
+    # Run a converter under limits: 'nice' (niceness), 'ionice'
+    # (CLASS[:LEVEL]) and 'timeout' (seconds per item). nice and
+    # ionice exec the converter. The converter gets its own process
+    # group, so a timeout kills anything it has started too (e.g. when
+    # avconv is a shell script frontend), which would otherwise keep
+    # its output open. A timed out run comes back with returncode None.
+    limits = limits or {}
+    prefix = []
+    if limits.get('ionice') is not None:
+        (ioclass, sep, level) = limits['ionice'].partition(':')
+        prefix.extend(['ionice', '-c', ioclass])
+        if level:
+            prefix.extend(['-n', level])
+    if limits.get('nice') is not None:
+        prefix.extend(['nice', '-n', str(limits['nice'])])
+    if prefix and shutil.which(cmd[0]) is None:
+        # Otherwise we'd only find out from nice/ionice's exit status
+        raise FileNotFoundError(cmd[0])
+    timeout = limits.get('timeout')
+    if timeout is not None:
+        timeout *= items
+    cmd = prefix + cmd
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            start_new_session=True)
+    log.info("[%d] Running: %s", proc.pid,
+             ' '.join(os.fsdecode(arg) for arg in cmd))
+    stdout = bytearray()
+    stderr = bytearray()
+    readers = [
+        threading.Thread(target=capture, args=(proc.stdout, 'stdout', proc.pid, stdout), daemon=True),
+        threading.Thread(target=capture, args=(proc.stderr, 'stderr', proc.pid, stderr), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        returncode = proc.wait(timeout=timeout)
+        # Output can still be held open by something the converter left
+        # running; that counts against the timeout too.
+        for reader in readers:
+            reader.join(None if deadline is None else max(0, deadline - time.monotonic()))
+    except subprocess.TimeoutExpired:
+        returncode = None
+    except BaseException:
+        killgroup(proc)
+        raise
+    if returncode is None or any(reader.is_alive() for reader in readers):
+        killgroup(proc)
+        returncode = None
+        for reader in readers:
+            reader.join(KILL_GRACE)
+    if returncode is None:
+        stderr.extend(b'Timed out after %d seconds, killed.\n' % timeout)
+    log.info("[%d] Exited: %s", proc.pid, returncode)
+    return subprocess.CompletedProcess(cmd, returncode, bytes(stdout), bytes(stderr))
+
+
+def capable(item, converter, profile):
+    # Whether converter can do everything item needs
+    if not item['extension'] in handlers[converter]:
+        return False
+    # sox can't copy streams without re-encoding
+    if converter == 'sox' and item.get('tagonly'):
+        return False
+    if converter == 'sox' and profile.get('replaygain') and item.get('gain') is not None \
+       and profile['ext'] not in sox_tags:
+        return False
+    return True
+
+
+def copy_args(item, converter):
+    # Options to keep every stream as is; only the tags change.
+    if item.get('tagonly'):
+        return ['-map', '0', '-c', 'copy']
+    return []
+
+
+def convert(item, converter, profile, limits=None):
+    print(b"Converting: " + b' => '.join([item['origin'], item['target']]))
+    if 0:
+        cmd = ['echo', item['origin'], item['target']]
+        return subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if converter == 'sox':
+        cmd = ['sox', item['origin']]
+        if 'sox' in profile:
+            cmd.extend(profile['sox'])
+        (before, after) = gain_args(item, converter, profile)
+        cmd.extend(before)
+        cmd.append(item['target'])
+        cmd.extend(after)
+        return run_converter(cmd, limits)
+    elif converter == 'avconv':
+        cmd = ['avconv', '-i', item['origin']]
+        if 'avconv' in profile:
+            cmd.extend(profile['avconv'])
+        cmd.extend(copy_args(item, converter))
+        (before, after) = gain_args(item, converter, profile)
+        cmd.extend(before)
+        cmd.append(item['target'])
+        cmd.extend(after)
+        return run_converter(cmd, limits)
+    elif converter == 'ffmpeg':
+        cmd = ['ffmpeg', '-i', item['origin']]
+        if 'ffmpeg' in profile:
+            cmd.extend(profile['ffmpeg'])
+        cmd.extend(copy_args(item, converter))
+        (before, after) = gain_args(item, converter, profile)
+        cmd.extend(before)
+        cmd.append(item['target'])
+        cmd.extend(after)
+        return run_converter(cmd, limits)
+    else:
+        msg = "Unknown converter: {conv}\n".format(conv=converter)
+        sys.stderr.write(msg)
+        raise UnknownConverter(msg)
+
+
+def convert_batch(batch, converter, profile, limits=None):
+    # One process, many files: -i a -i b ... -map 0:a:0 outA -map 1:a:0 outB
+    for item in batch:
+        print(b"Converting: " + b' => '.join([item['origin'], item['target']]))
+    if converter not in batchable:
+        msg = "Converter cannot batch: {conv}\n".format(conv=converter)
+        sys.stderr.write(msg)
+        raise UnknownConverter(msg)
+    cmd = [converter, '-n']
+    for item in batch:
+        cmd.extend(['-i', item['origin']])
+    for n, item in enumerate(batch):
+        # Output options apply to the next output only. Metadata would
+        # otherwise all come from the first input. Map what a single-file
+        # run picks by default: the first audio stream and any cover art.
+        cmd.extend(['-map', '%d:a:0' % n, '-map', '%d:v:0?' % n, '-map_metadata', str(n)])
+        if converter in profile:
+            cmd.extend(profile[converter])
+        cmd.extend(gain_args(item, converter, profile)[0])
+        cmd.append(item['target'])
+    return run_converter(cmd, limits, len(batch))
+
+
+def batch_converter(item):
+    # First installed converter able to batch this item, if any.
+    if item.get('tagonly'):
+        # Stream copies are cheap; not worth fitting into a batch
+        return None
+    for converter in preference:
+        if converter in batchable and item['extension'] in handlers[converter]:
+            if shutil.which(converter) is not None:
+                return converter
+    return None
+
+
+def convert_item(item, profile, limits=None):
+    # Try each converter able to handle item until one works. Returns
+    # list of errors for item, one per failed attempt, if none did.
+    itemerrs = []
+    ran = False
+    for converter in preference:
+        if not capable(item, converter, profile):
+            continue
+        try:
+            status = convert(item, converter, profile, limits)
+        except FileNotFoundError as e:
+            print("Unable to use preferred converter '%s', File Not Found.\n" % converter)
+            itemerrs.append({
+                'item': item,
+                'stdout': '',
+                'stderr': "Unable to use preferred converter '%s', File Not Found.\n" % converter,
+                'rc': None
+            })
+            continue
+        ran = True
+        if status.returncode == 0:
+            return []
+        # Don't leave a partial file to be skipped next time
+        if os.path.exists(item['target']):
+            os.unlink(item['target'])
+        print("Converter '%s' failed (rc %s), trying next.\n" % (converter, status.returncode))
+        itemerrs.append({
+            'item': item,
+            'stdout': status.stdout,
+            'stderr': status.stderr,
+            'rc': status.returncode
+        })
+    if not ran:
+        # Not necessarily the extension's fault; see capable()
+        sys.stderr.write('No usable handler for extension: {ext}\n'.format(ext=item['extension']))
+        itemerrs.append({
+            'item': item,
+            'stdout': '',
+            'stderr': 'No handler for extension: {ext}\n'.format(ext=item['extension']),
+            'rc': None
+        })
+    return itemerrs
+
+
+def convert_batch_items(batch, converter, profile, limits=None):
+    # Returns list of errors for items in batch
+    if len(batch) == 1:
+        return convert_item(batch[0], profile, limits)
+    try:
+        status = convert_batch(batch, converter, profile, limits)
+        if status.returncode == 0:
+            return []
+        print("Batch of %d failed (rc %s), converting individually.\n" % (len(batch), status.returncode))
+    except FileNotFoundError as e:
+        print("Unable to use batch converter '%s', File Not Found.\n" % converter)
+    # A failed batch can't tell us which input was at fault, so throw
+    # away whatever it wrote and redo each item alone to find out.
+    errors = []
+    for item in batch:
+        if os.path.exists(item['target']):
+            os.unlink(item['target'])
+        errors.extend(convert_item(item, profile, limits))
+    return errors
@@ -0,0 +1,121 @@
+#
+# Copy/convert planned items, locally or on workers.
+#
+
+import os
+import queue
+import subprocess
+import sys
+
+from .converters import profiles, extensions, batch_converter, convert_item, convert_batch_items
+from .governor import Governor, run_jobs
+
+
+def execute(items, profilename, batch=1, workers=(), shared=False, limits=None,
+            jobs=1, loadaware=False):
+    # Returns list of errors. workers are (host, port) addresses; limits
+    # are as for converters.run_converter. Local conversions run up to
+    # jobs at a time (0 for one per CPU), fewer when the machine is busy
+    # if loadaware. With workers, local jobs take items from the same
+    # queue as the workers do.
+    profile = profiles[profilename]
+    errors = []
+    targets = set()
+    remote = []
+    local = []
+    pending = []
+    batchconv = None
+    for itemlist in items.values():
+        for item in itemlist:
+            if os.path.exists(item['target']) or item['target'] in targets:
+                print("Skipping target (exists): {target}".format(target=item['target']))
+                continue
+            if not os.path.exists(item['origin']):
+                print("Skipping origin (does not exist): {origin}".format(origin=item['origin']))
+                continue
+            # Nothing is written until the jobs run, so keep track of
+            # targets here rather than relying on exists().
+            targets.add(item['target'])
+            if not os.path.isdir(item['dir']):
+                print("Creating directory: {dirname}".format(dirname=item['dir']))
+                subprocess.run(['mkdir', '-p', item['dir']], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            if item['copy']:
+                cmd = ['cp', item['origin'], item['target']]
+                print(b"Copying: " + b' => '.join([item['origin'], item['target']]))
+                status = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                if status.returncode != 0:
+                    errors.append({
+                        'item': item,
+                        'stdout': status.stdout,
+                        'stderr': status.stderr,
+                        'rc': status.returncode,
+                    })
+                continue
+            # Items nothing can convert fail locally, without a round trip
+            if workers and item['extension'] in extensions:
+                remote.append(item)
+                continue
+            if batch > 1:
+                converter = batch_converter(item)
+                if converter is not None:
+                    if pending and converter != batchconv:
+                        local.append((convert_batch_items, (pending, batchconv, profile, limits)))
+                        pending = []
+                    batchconv = converter
+                    pending.append(item)
+                    if len(pending) >= batch:
+                        local.append((convert_batch_items, (pending, batchconv, profile, limits)))
+                        pending = []
+                    continue
+            local.append((convert_one, (item, profile, limits)))
+    if pending:
+        local.append((convert_batch_items, (pending, batchconv, profile, limits)))
+    governor = Governor(jobs, loadaware)
+    if remote:
+        from .remote import distribute
+
+        def alongside(pending):
+            # Enough jobs to take every item, should the workers take none
+            shared_jobs = [(convert_next, (pending, batch, profile, limits))] * len(remote)
+            return run_jobs(local + shared_jobs, governor)
+
+        errors.extend(distribute(remote, workers, profilename, shared, limits, alongside))
+    elif local:
+        errors.extend(run_jobs(local, governor))
+    return errors
+
+
+def convert_one(item, profile, limits):
+    print("Trying to convert from '%(origin)s' to '%(target)s'..." % item)
+    return convert_item(item, profile, limits)
+
+
+def convert_next(pending, batch, profile, limits):
+    # Convert the next item from a queue shared with workers, with as
+    # many more after it as fit in a batch. Returns errors as usual.
+    try:
+        item = pending.get_nowait()
+    except queue.Empty:
+        return []
+    converter = batch_converter(item) if batch > 1 else None
+    if converter is None:
+        return convert_one(item, profile, limits)
+    items = [item]
+    while len(items) < batch:
+        try:
+            item = pending.get_nowait()
+        except queue.Empty:
+            break
+        if batch_converter(item) != converter:
+            pending.put(item)
+            break
+        items.append(item)
+    return convert_batch_items(items, converter, profile, limits)
+
+
+def report(errors, out=sys.stderr):
+    if errors:
+        out.write("ERRORS:\n")
+    for error in errors:
+        out.write("*****\nOrigin: %s\nStdout: %s\nStderr: %s\nRC: %s\n" %
+                  (error['item']['origin'], error['stdout'], error['stderr'], error['rc']))
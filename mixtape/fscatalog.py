@@ -0,0 +1,45 @@
+#
+# Persistent catalog of directory listings for fs playlists, in SQLite
+# (see sources.fs_listdir for when they're used). Listings are also
+# kept in-process, so later syncs in the same process needn't reload
+# them.
+#
+
+import sqlite3
+
+loaded = {}
+
+def catalog_open(path):
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE IF NOT EXISTS dirs ("
+               "path BLOB PRIMARY KEY, mtime INTEGER NOT NULL, "
+               "dirs BLOB NOT NULL, files BLOB NOT NULL)")
+    return db
+
+
+def catalog_load(path):
+    # Returns {dirpath: (mtime, subdirs, files)}
+    if path in loaded:
+        return dict(loaded[path])
+    cached = {}
+    db = catalog_open(path)
+    # Names can't contain NUL, so use it to join them
+    for (dirpath, mtime, dirs, files) in db.execute("SELECT path, mtime, dirs, files FROM dirs"):
+        cached[dirpath] = (mtime, dirs.split(b'\0') if dirs else [], files.split(b'\0') if files else [])
+    db.close()
+    loaded[path] = cached
+    return dict(cached)
+
+
+def catalog_save(path, updates, stale):
+    db = catalog_open(path)
+    db.executemany("DELETE FROM dirs WHERE path = ?", [(dirpath,) for dirpath in stale])
+    db.executemany("INSERT OR REPLACE INTO dirs (path, mtime, dirs, files) VALUES (?, ?, ?, ?)",
+                   [(dirpath, mtime, b'\0'.join(dirs), b'\0'.join(files))
+                    for dirpath, (mtime, dirs, files) in updates.items()])
+    db.commit()
+    db.close()
+    if path in loaded:
+        for dirpath in stale:
+            loaded[path].pop(dirpath, None)
+        loaded[path].update(updates)
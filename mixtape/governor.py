@@ -0,0 +1,73 @@
+#
+# Running conversion jobs in parallel, with the number running at once
+# optionally following how busy the machine is.
+#
+
+import collections
+import concurrent.futures
+import os
+
+# How often to reconsider concurrency while jobs are running (seconds)
+POLL = 5
+
+# CPU pressure (% of time some task was waiting for CPU, over the last
+# 10s) above which to shed a job, and below which to add one.
+PSI_HIGH = 40.0
+PSI_LOW = 10.0
+
+
+def cpu_pressure():
+    # Returns PSI 'some avg10' for CPU, or None if unavailable
+    try:
+        with open('/proc/pressure/cpu') as f:
+            for line in f:
+                fields = line.split()
+                if fields and fields[0] == 'some':
+                    for field in fields[1:]:
+                        (key, sep, value) = field.partition('=')
+                        if key == 'avg10':
+                            return float(value)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class Governor:
+    def __init__(self, jobs=1, loadaware=False):
+        # jobs is the most to run at once; 0 means one per CPU
+        self.jobs = jobs or os.cpu_count() or 1
+        self.loadaware = loadaware
+
+    def allowed(self, running):
+        # How many jobs may run now, given we're already running some
+        if not self.loadaware:
+            return self.jobs
+        pressure = cpu_pressure()
+        if pressure is not None:
+            if pressure > PSI_HIGH:
+                return max(1, running - 1)
+            if pressure > PSI_LOW:
+                return max(1, min(self.jobs, running))
+            return self.jobs
+        # Otherwise go by spare CPUs. Our own jobs count towards the
+        # load average, so don't hold them against ourselves.
+        spare = (os.cpu_count() or 1) - (os.getloadavg()[0] - running)
+        return max(1, min(self.jobs, int(spare)))
+
+
+def run_jobs(jobs, governor):
+    # jobs are (function, args) returning lists of errors; returns all errors
+    errors = []
+    pending = collections.deque(jobs)
+    running = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=governor.jobs) as pool:
+        while pending or running:
+            allowed = governor.allowed(len(running))
+            while pending and len(running) < allowed:
+                (func, args) = pending.popleft()
+                running.add(pool.submit(func, *args))
+            (done, running) = concurrent.futures.wait(
+                running, timeout=POLL, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                errors.extend(future.result())
+    return errors
@@ -0,0 +1,152 @@
+#
+# Loudness measurement and gains for profiles with 'loudness' set.
+#
+# Loudness is measured once per file content, ever: files maps
+# path/size/mtime to a content digest (so unchanged files aren't
+# re-read), and loudness maps digests to measurements. Measurements
+# are also kept in-process between syncs.
+#
+
+import collections
+import hashlib
+import math
+import os
+import re
+import shutil
+import sqlite3
+import sys
+
+from .converters import run_converter, extensions
+
+# (path, size, mtime) => measurement, for this process
+memo = {}
+
+def gaincache_open(path):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE IF NOT EXISTS files ("
+               "path BLOB PRIMARY KEY, size INTEGER NOT NULL, "
+               "mtime INTEGER NOT NULL, digest TEXT NOT NULL)")
+    db.execute("CREATE TABLE IF NOT EXISTS loudness ("
+               "digest TEXT PRIMARY KEY, integrated REAL NOT NULL, "
+               "peak REAL NOT NULL, duration REAL NOT NULL)")
+    return db
+
+
+def content_digest(db, path):
+    st = os.stat(path)
+    row = db.execute("SELECT digest FROM files WHERE path = ? AND size = ? AND mtime = ?",
+                     (path, st.st_size, st.st_mtime_ns)).fetchone()
+    if row is not None:
+        return row[0]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    digest = digest.hexdigest()
+    db.execute("INSERT OR REPLACE INTO files (path, size, mtime, digest) VALUES (?, ?, ?, ?)",
+               (path, st.st_size, st.st_mtime_ns, digest))
+    return digest
+
+
+def measure_loudness(path, limits=None):
+    # Returns (integrated LUFS, sample peak dBFS, duration secs) or None
+    cmd = ['ffmpeg', '-nostdin', '-i', path,
+           '-map', '0:a:0', '-af', 'ebur128=peak=sample', '-f', 'null', '-']
+    status = run_converter(cmd, limits)
+    if status.returncode != 0:
+        return None
+    # Only the tail of the output is kept, so go by the last progress
+    # report for duration rather than the header. The summary comes
+    # last; earlier I: matches are per-frame.
+    integrated = re.findall(rb'I:\s+(-?[\d.]+) LUFS', status.stderr)
+    peak = re.findall(rb'Peak:\s+(-?[\d.]+|-inf) dBFS', status.stderr)
+    duration = re.findall(rb'time=(\d+):(\d+):([\d.]+)', status.stderr)
+    if not integrated or not peak or not duration:
+        return None
+    (hours, minutes, seconds) = duration[-1]
+    return (float(integrated[-1]), float(peak[-1]),
+            int(hours) * 3600 + int(minutes) * 60 + float(seconds))
+
+
+def loudness(db, path, limits=None):
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    if key in memo:
+        return memo[key]
+    digest = content_digest(db, path)
+    row = db.execute("SELECT integrated, peak, duration FROM loudness WHERE digest = ?",
+                     (digest,)).fetchone()
+    if row is not None:
+        db.commit()
+        memo[key] = row
+        return row
+    print(b"Measuring loudness: " + path)
+    measured = measure_loudness(path, limits)
+    if measured is not None:
+        db.execute("INSERT OR REPLACE INTO loudness (digest, integrated, peak, duration) "
+                   "VALUES (?, ?, ?, ?)", (digest,) + measured)
+        memo[key] = measured
+    db.commit()
+    return measured
+
+
+def album_loudness(tracks):
+    # Duration-weighted energy mean of the tracks, which is close to
+    # what measuring them end to end would give.
+    total = sum(duration for (integrated, peak, duration) in tracks)
+    if total <= 0:
+        return None
+    energy = sum(duration * 10 ** (integrated / 10) for (integrated, peak, duration) in tracks)
+    return (10 * math.log10(energy / total), max(peak for (integrated, peak, duration) in tracks))
+
+
+def set_gains(items, profile, db, album, limits=None):
+    # Set item['gain'] for every item that's going to be converted. With
+    # album, each playlist's tracks share their album gain and peak.
+    if shutil.which('ffmpeg') is None:
+        sys.stderr.write("WARNING: ffmpeg not found, unable to measure loudness\n")
+        return []
+    errors = []
+    measured = {}
+    playlists = collections.OrderedDict()
+    for itemlist in items.values():
+        for item in itemlist:
+            item['gain'] = None
+            # Cover art, cue sheets etc.: nothing will convert them
+            if item['extension'] not in extensions:
+                continue
+            if not os.path.exists(item['origin']):
+                continue
+            if os.path.exists(item['target']) and not album:
+                continue
+            if item['origin'] not in measured:
+                measured[item['origin']] = loudness(db, item['origin'], limits)
+                if measured[item['origin']] is None:
+                    errors.append({
+                        'item': item,
+                        'stdout': '',
+                        'stderr': 'Unable to measure loudness, converting without gain\n',
+                        'rc': None
+                    })
+            if measured[item['origin']] is not None:
+                playlists.setdefault(item['playlist'], []).append(item)
+    for plitems in playlists.values():
+        if album:
+            albumlevel = album_loudness([measured[item['origin']] for item in plitems])
+        for item in plitems:
+            (integrated, peak, duration) = measured[item['origin']]
+            gain = {
+                'track_gain': profile['loudness'] - integrated,
+                'track_peak': 10 ** (peak / 20),
+            }
+            if album and albumlevel is not None:
+                gain['album_gain'] = profile['loudness'] - albumlevel[0]
+                gain['album_peak'] = 10 ** (albumlevel[1] / 20)
+                # Keep headroom rather than clip when applying gain
+                gain['apply'] = min(gain['album_gain'], -1.0 - albumlevel[1])
+            else:
+                gain['apply'] = min(gain['track_gain'], -1.0 - peak)
+            item['gain'] = gain
+    return errors
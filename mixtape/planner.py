@@ -0,0 +1,80 @@
+#
+# Planning: name each item's target file and decide whether it can be
+# copied or has to be converted.
+#
+
+import os
+import pprint
+import re
+import sys
+
+from .converters import extensions
+from .util import debug, dformat
+
+
+def common_prefix(items):
+    return os.path.dirname(os.path.commonprefix(list(items.keys())))
+
+
+def name_item(item, target, prefix, single=False, named=False, mangle=False):
+    # Returns target path, keeping the original filename (and extension)
+    if single:
+        mungename = os.path.basename(item['origin'])
+    elif named:
+        mungename = os.path.join(item['playlist'], os.path.basename(item['origin']))
+    else:
+        mungename = os.path.relpath(item['origin'], prefix)
+    # Get rid of dodgy characters in filename if desired
+    if mangle:
+        mungename = re.sub(b'[^a-zA-Z0-9_/.]', b'_', mungename)
+    # Build target path with original filename
+    return os.path.join(target.encode(), mungename)
+
+
+def plan(items, target, profile, single=False, named=False, number=False,
+         mangle=False, recode=False):
+    # Set dir, extension, copy and target on every item
+    prefix = common_prefix(items)
+    numbering = None
+    if (named or single) and number:
+        numbering = {
+            'digits': len(str(len(items))) + 1,
+            'number': 0,
+        }
+
+    for itemlist in items.values():
+        for item in itemlist:
+            mungename = name_item(item, target, prefix, single, named, mangle)
+            # Get dirname and filename
+            (dirname, oldfilename) = os.path.split(mungename)
+            debug(1, "dirname: " + dformat(1, dirname))
+            debug(1, "oldfilename: " + dformat(1, oldfilename))
+            debug(1, "mungename: " + dformat(1, mungename))
+            item['dir'] = dirname
+            # Switch or add appropriate extension
+            filenameparts = oldfilename.rsplit(b'.', 1)
+            sys.stderr.write("filenameparts is: " + pprint.pformat(filenameparts) + "\n")
+            if len(filenameparts) == 2 and filenameparts[1].lower().decode('utf8') in extensions:
+                item['extension'] = filenameparts[1].lower().decode('utf8')
+                debug(1, "newfilename is 0th part of oldfilename plus profile extension")
+                newfilename = b'.'.join((filenameparts[0], profile['ext'].encode()))
+                # While we're at it, set bool to indicate if we can just copy
+                # file rather than transcoding. Decision based on old extension.
+                # Yuk. Tag-only profiles still need the file rewritten with
+                # tags, but without re-encoding it.
+                if item['extension'] == profile['ext'] and not recode:
+                    if profile.get('replaygain'):
+                        item['tagonly'] = True
+                    elif 'loudness' not in profile:
+                        item['copy'] = True
+            else:
+                item['extension'] = None
+                debug(1, "newfilename is mungename plus profile extension")
+                newfilename = b'.'.join((mungename, profile['ext'].encode()))
+            # Put target back together again
+            if numbering is not None:
+                numbering['number'] += 1
+                numprefix = f"{numbering['number']:0{numbering['digits']}}--".encode()
+                newfilename = numprefix + newfilename
+            item['target'] = os.path.join(dirname, newfilename)
+    return items
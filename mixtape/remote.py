@@ -0,0 +1,344 @@
+#
+# Farming conversions out to workers over TCP.
+#
+# Each message is a length-prefixed JSON header followed by the raw
+# blobs whose lengths it lists. Files are streamed in chunks rather
+# than read into memory. Paths go in the header via os.fsdecode,
+# so undecodable bytes survive the trip.
+#
+
+import json
+import os
+import queue
+import shutil
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+from urllib.parse import unquote_to_bytes
+
+from .converters import profiles, preference, convert_item, KILL_GRACE
+
+def parse_address(address, defaulthost):
+    # [HOST:]PORT => (host, port)
+    (host, sep, port) = address.rpartition(':')
+    if not sep:
+        host = defaulthost
+    return (host, int(port))
+
+# Size of chunks blobs are copied in
+CHUNK = 1 << 20
+
+# Seconds to wait for a worker to accept a connection, and for each
+# send/recv once connected. The wait for a reply covers the whole
+# conversion, so without a converter timeout to go by that's allowed
+# IDLE_TIMEOUT, and with one, enough for every converter to time out
+# plus IDLE_GRACE.
+CONNECT_TIMEOUT = 30
+IDLE_TIMEOUT = 900
+IDLE_GRACE = 10
+
+def send_msg(sock, header, *blobs):
+    # blobs are bytes, or binary files sent from where they are to EOF
+    sizes = []
+    for blob in blobs:
+        if isinstance(blob, bytes):
+            sizes.append(len(blob))
+        else:
+            sizes.append(os.fstat(blob.fileno()).st_size - blob.tell())
+    header = dict(header, blobs=sizes)
+    data = json.dumps(header).encode()
+    sock.sendall(struct.pack('!I', len(data)) + data)
+    for blob in blobs:
+        if isinstance(blob, bytes):
+            sock.sendall(blob)
+        else:
+            sock.sendfile(blob)
+
+
+def recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, CHUNK))
+        if not chunk:
+            raise ConnectionError("Connection closed mid-message")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_header(sock):
+    (size,) = struct.unpack('!I', recv_exact(sock, 4))
+    return json.loads(recv_exact(sock, size))
+
+
+def recv_blob(sock, size, out=None):
+    # Copy a blob to out in chunks, or discard it if out is None.
+    # Returns any OSError from writing to out rather than raising it;
+    # the rest of the blob is still read so the connection stays usable.
+    # Errors from the socket itself are raised as usual.
+    error = None
+    while size:
+        chunk = sock.recv(min(size, CHUNK))
+        if not chunk:
+            raise ConnectionError("Connection closed mid-message")
+        size -= len(chunk)
+        if out is not None and error is None:
+            try:
+                out.write(chunk)
+            except OSError as e:
+                error = e
+    return error
+
+
+def recv_file(sock, size, path):
+    # recv_blob into a new file at path; returns any OSError writing it
+    try:
+        out = open(path, 'wb')
+    except OSError as e:
+        recv_blob(sock, size)
+        return e
+    try:
+        error = recv_blob(sock, size, out)
+    except BaseException:
+        out.close()
+        raise
+    try:
+        out.close()
+    except OSError as e:
+        error = error or e
+    return error
+
+
+def tobytes(output):
+    if isinstance(output, str):
+        return output.encode()
+    return output
+
+
+class WorkerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        request = recv_header(self.request)
+        workdir = tempfile.mkdtemp(prefix='musicmaker-')
+        output = None
+        try:
+            source = None
+            error = None
+            if request['blobs']:
+                # Keep the extension; sox goes by it to work out the type.
+                source = os.path.join(workdir.encode(),
+                                      b'source.' + os.fsencode(request['extension'] or ''))
+                error = recv_file(self.request, request['blobs'][0], source)
+            # Whatever goes wrong with the item, the coordinator gets a
+            # reply; a closed connection would make it drop this worker.
+            try:
+                if error is not None:
+                    raise error
+                (itemerrs, target) = self.convert(request, source, workdir)
+                if target is not None:
+                    output = open(target, 'rb')
+            except Exception as e:
+                itemerrs = [{
+                    'stdout': b'',
+                    'stderr': "Worker failed: {err}\n".format(err=e).encode(),
+                    'rc': None,
+                }]
+            replyblobs = [output if output is not None else b'']
+            for error in itemerrs:
+                replyblobs.extend([tobytes(error['stdout']), tobytes(error['stderr'])])
+            send_msg(self.request, {
+                'errors': [{'rc': error['rc']} for error in itemerrs],
+                'output': output is not None,
+            }, *replyblobs)
+        finally:
+            if output is not None:
+                output.close()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def limits(self, request):
+        # Our own limits, with the coordinator's timeout if it's stricter
+        limits = dict(self.server.limits or {})
+        timeout = request.get('timeout')
+        if timeout is not None and timeout > 0:
+            if limits.get('timeout') is None or timeout < limits['timeout']:
+                limits['timeout'] = timeout
+        return limits
+
+    def convert(self, request, source, workdir):
+        # Returns (errors, path of output or None)
+        if request['profile'] not in profiles:
+            return ([{
+                'stdout': b'',
+                'stderr': "Unknown profile: {profile}\n".format(profile=request['profile']),
+                'rc': None,
+            }], None)
+        wprofile = profiles[request['profile']]
+        if request['shared']:
+            origin = os.fsencode(request['origin'])
+            if self.server.translatefrom is not None:
+                origin = origin.replace(
+                    unquote_to_bytes(self.server.translatefrom),
+                    unquote_to_bytes(self.server.translateto),
+                    1)
+            # Anything else could be a URL to ffmpeg (http:, concat: ...)
+            if not os.path.isabs(origin):
+                return ([{
+                    'stdout': b'',
+                    'stderr': b"Origin is not an absolute local path: " + origin + b"\n",
+                    'rc': None,
+                }], None)
+        else:
+            origin = source
+        item = {
+            'copy': False,
+            'uri': None,
+            'origin': origin,
+            'playlist': b'',
+            'gain': request['gain'],
+            'tagonly': request.get('tagonly', False),
+            'extension': request['extension'],
+            'dir': workdir.encode(),
+            'target': os.path.join(workdir.encode(), b'target.' + wprofile['ext'].encode()),
+        }
+        itemerrs = convert_item(item, wprofile, self.limits(request))
+        if not itemerrs and os.path.exists(item['target']):
+            return (itemerrs, item['target'])
+        return (itemerrs, None)
+
+
+class WorkerServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def serve_worker(address, translatefrom=None, translateto=None, limits=None):
+    # Shared paths sent by the coordinator are translated from/to; limits
+    # are as for converters.run_converter
+    with WorkerServer(address, WorkerHandler) as server:
+        server.translatefrom = translatefrom
+        server.translateto = translateto
+        server.limits = limits
+        sys.stderr.write("Worker listening on {host}:{port}.\n".format(
+            host=server.server_address[0], port=server.server_address[1]))
+        server.serve_forever()
+
+
+def idle_timeout(limits):
+    # How long to wait on a worker before giving up on it, given the
+    # limits it'll be converting under
+    timeout = (limits or {}).get('timeout')
+    if timeout is None:
+        return IDLE_TIMEOUT
+    return len(preference) * (timeout + KILL_GRACE) + IDLE_GRACE
+
+
+def remote_convert(address, item, profilename, shared, limits=None):
+    # Returns list of errors for item, in the same shape as convert_item.
+    # Raises OSError/ValueError only for trouble with the worker itself
+    # (including it going quiet for longer than idle_timeout); local
+    # trouble reading the origin or writing the target is an error for
+    # the item.
+    print(b"Sending to %s:%d: " % (address[0].encode(), address[1])
+          + b' => '.join([item['origin'], item['target']]))
+    request = {
+        'profile': profilename,
+        'extension': item['extension'],
+        'shared': shared,
+        'origin': os.fsdecode(item['origin']),
+        'gain': item.get('gain'),
+        'tagonly': item.get('tagonly', False),
+        'timeout': (limits or {}).get('timeout'),
+    }
+    source = None
+    if not shared:
+        try:
+            source = open(item['origin'], 'rb')
+        except OSError as e:
+            return [{
+                'item': item,
+                'stdout': b'',
+                'stderr': "Unable to read origin: {err}\n".format(err=e).encode(),
+                'rc': None,
+            }]
+    try:
+        with socket.create_connection(address, CONNECT_TIMEOUT) as sock:
+            sock.settimeout(idle_timeout(limits))
+            send_msg(sock, request, *([source] if source is not None else []))
+            reply = recv_header(sock)
+            sizes = reply['blobs']
+            writeerr = None
+            if reply['output']:
+                writeerr = recv_file(sock, sizes[0], item['target'])
+            else:
+                recv_blob(sock, sizes[0])
+            outputs = [recv_exact(sock, size) for size in sizes[1:]]
+    finally:
+        if source is not None:
+            source.close()
+    errors = []
+    for n, error in enumerate(reply['errors']):
+        errors.append({
+            'item': item,
+            'stdout': outputs[2 * n],
+            'stderr': outputs[2 * n + 1],
+            'rc': error['rc'],
+        })
+    if writeerr is not None:
+        if os.path.isfile(item['target']):
+            os.unlink(item['target'])
+        errors.append({
+            'item': item,
+            'stdout': b'',
+            'stderr': "Unable to write target: {err}\n".format(err=writeerr).encode(),
+            'rc': None,
+        })
+    return errors
+
+
+def distribute(items, addresses, profilename, shared, limits=None, local=None):
+    # One thread per worker slot, each pulling from a shared queue. If
+    # given, local is called with the queue while the workers run, to
+    # convert some of it here too, and returns a list of errors.
+    # A worker that can't be reached, goes quiet or breaks the protocol
+    # is dropped and its item put back; anything left when all workers
+    # are gone is converted locally. Items that fail on a worker come back as errors.
+    pending = queue.Queue()
+    for item in items:
+        pending.put(item)
+    errors = []
+    lock = threading.Lock()
+
+    def run(address):
+        while True:
+            try:
+                item = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                itemerrs = remote_convert(address, item, profilename, shared, limits)
+            except (OSError, ValueError) as e:
+                sys.stderr.write("Dropping worker {host}:{port}: {err}\n".format(
+                    host=address[0], port=address[1], err=e))
+                if os.path.exists(item['target']):
+                    os.unlink(item['target'])
+                pending.put(item)
+                return
+            with lock:
+                errors.extend(itemerrs)
+
+    threads = [threading.Thread(target=run, args=(address,)) for address in addresses]
+    for thread in threads:
+        thread.start()
+    if local is not None:
+        localerrs = local(pending)
+        with lock:
+            errors.extend(localerrs)
+    for thread in threads:
+        thread.join()
+    while not pending.empty():
+        item = pending.get_nowait()
+        print("Trying to convert from '%(origin)s' to '%(target)s'..." % item)
+        errors.extend(convert_item(item, profiles[profilename], limits))
+    return errors
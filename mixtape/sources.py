@@ -0,0 +1,309 @@
+#
+# Playlist readers. Each returns an OrderedDict mapping origin path to
+# a list of items, one per place the file is wanted on the target.
+#
+
+import collections
+import concurrent.futures
+import codecs
+import os
+import re
+import sys
+import time
+from urllib.parse import urlparse, unquote, unquote_to_bytes
+
+from .util import debug, dformat
+
+def addtoconvert(newitem, items, named):
+    # Avoid copy/converting twice to same destination
+    # Not sure if debugging makes it harder or easier to read.
+    debug(100, 'items:\n%s' % dformat(100, items))
+    for item in items[newitem['origin']]:
+        debug(1, "Comparing to name: {}, playlist: {}\n".format(item['origin'], item['playlist']))
+        if item['origin'] == newitem['origin']:
+            if item['playlist'] == newitem['playlist'] or not named:
+                debug(1, "MATCHED.")
+                # Break past for loop's else
+                break
+            else:
+                debug(1, "No match (playlist).")
+        else:
+            debug("No match (name).")
+    # This else is on the for loop. So we're only doing this if
+    # we didn't match existing name & playlist (and therefore
+    # take the break).
+    else:
+        items[newitem['origin']].append(newitem)
+    return items
+
+
+# Synology playlists seem to be UTF8 dir, Windows-1252 file
+#
+# But no! Not even windows-1252. Much is, but some already UTF8.
+#
+"""
+This is based on Victor Stinner's pure-Python implementation of PEP 383: the "surrogateescape" error
+handler of Python 3.
+Source: misc/python/surrogateescape.py in https://bitbucket.org/haypo/misc
+"""
+
+# This code is released under the Python license and the BSD 2-clause license
+
+def maybe1252_handler(exc):
+    mystring = exc.object[exc.start:exc.end]
+
+    try:
+        # we only decode
+        if isinstance(exc, UnicodeDecodeError):
+            # mystring is a byte-string in this case
+            decoded = replace_1252_decode(mystring)
+        else:
+            raise exc
+    except Not1252Error:
+        raise exc
+    return (decoded, exc.end)
+
+class Not1252Error(Exception):
+    pass
+
+def replace_1252_decode(mybytes):
+    """
+    Returns a string
+    """
+    decoded = []
+    for code in mybytes:
+        if 0x80 <= code <= 0xFF:
+            decoded.append(bytes([code]).decode('windows-1252'))
+        elif code <= 0x7F:
+            decoded.append(chr(code))
+        else:
+            # # It may be a bad byte
+            # # Try swallowing it.
+            # continue
+            # print("RAISE!")
+            raise NotASurrogateError
+    return str().join(decoded)
+
+codecs.register_error('maybe1252', maybe1252_handler)
+
+def synofix(mfile):
+    mbase = os.path.basename(mfile)
+    mbase = mbase.decode('utf-8', errors='maybe1252')
+    mdir = os.path.dirname(mfile).decode('utf-8')
+    mfile = os.fsencode(os.path.join(mdir, mbase))
+    return mfile
+
+def m3u_readfile(path, items, named=False, fix_synology=False):
+    # make path be bytes
+    path = os.fsencode(path)
+    plname = os.path.basename(path)
+    if plname.endswith(b'.m3u'):
+        plname = plname[:-4]
+    m3ufile = open(path, 'rb')
+    # Read and ignore 1st line (expect it to be '#EXTM3U')
+    if m3ufile.readline() == '':
+        return items
+    for mfile in m3ufile.readlines():
+        # strip trailing \n, \r
+        mfile = re.sub(rb'[\n\r]*$', b'', mfile)
+        mfile = unquote_to_bytes(mfile)
+        if fix_synology:
+            debug(1, "Synofix item: %s" % dformat(1, mfile))
+            mfile = synofix(mfile)
+            debug(1, "Synofixed item: %s" % dformat(1, mfile))
+        if not mfile in items:
+            debug(1, "Creating toconvert item: %s" % dformat(1, mfile))
+            items[mfile] = []
+        addtoconvert(
+            {
+                'copy': False,
+                'uri': None,
+                'origin': mfile,
+                'playlist': plname,
+            },
+            items, named)
+
+
+# Directory mtimes only change when entries are added, removed or
+# renamed, so an unchanged mtime means a cached listing still holds.
+# Listings less than this old are not cached, as the directory could
+# change again within the same mtime tick.
+RACY_NS = 2 * 10**9
+
+def fs_listdir(path, scan):
+    # Returns (subdirs, files) as os.walk would, from cache if possible.
+    # Symlinks to directories are neither descended into nor files.
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    scan['seen'].add(path)
+    cached = scan['cached'].get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1:]
+    dirs = []
+    files = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    isdir = entry.is_dir()
+                except OSError:
+                    isdir = False
+                if not isdir:
+                    files.append(entry.name)
+                elif not entry.is_symlink():
+                    dirs.append(entry.name)
+    except OSError:
+        return None
+    if mtime < scan['started'] - RACY_NS:
+        scan['updates'][path] = (mtime, dirs, files)
+    return (dirs, files)
+
+
+def fs_walk(top, scan):
+    # Top-down walk yielding (dirname, files), in os.walk order
+    listing = fs_listdir(top, scan)
+    if listing is None:
+        return
+    (dirs, files) = listing
+    yield (top, files)
+    for name in dirs:
+        yield from fs_walk(os.path.join(top, name), scan)
+
+
+def fs_scan(plpath, scan):
+    # Walk each top-level subdirectory in its own thread, since on
+    # network filesystems the time goes on waiting for stat/readdir.
+    listing = fs_listdir(plpath, scan)
+    if listing is None:
+        return []
+    (dirs, files) = listing
+    with concurrent.futures.ThreadPoolExecutor() as pool:
+        subtrees = [pool.submit(lambda sub: list(fs_walk(sub, scan)),
+                                os.path.join(plpath, name))
+                    for name in dirs]
+        return [(plpath, files)] + [walked for subtree in subtrees for walked in subtree.result()]
+
+
+def fs_readdir(plpath, items, scan, named=False):
+    # seems basename is bytes in bytes out, str in str out?
+    plname = os.path.basename(plpath)
+    for dirname, files in fs_scan(plpath, scan):
+        for mfile in files:
+            mpath = os.fsencode(os.path.join(dirname, mfile))
+            if not mpath in items:
+                debug(1, "Creating toconvert item in pl '%s': %s" % (plname, dformat(1, mpath)))
+                items[mpath] = []
+            addtoconvert(
+                {
+                    'copy': False,
+                    'uri': None,
+                    'origin': mpath,
+                    'playlist': plname,
+                },
+                items, named)
+
+
+def fs_getsources(origin, pl_names, named=False, catalog=None):
+    # Read specified sudirectories of origin as playlists, add contents to OrderedDict and return.
+    # With catalog (an SQLite file path), only re-read directories that have changed.
+    toconvert = collections.OrderedDict()
+    plfilenames = []
+    scan = {
+        'cached': {},
+        'updates': {},
+        'seen': set(),
+        'started': time.time_ns(),
+    }
+    if catalog is not None:
+        from . import fscatalog
+        scan['cached'] = fscatalog.catalog_load(catalog)
+    scanned = []
+    for pl in pl_names:
+        # encode path to bytes
+        path = os.path.join(origin, pl).encode('utf-8')
+        if os.path.isdir(path):
+            fs_readdir(path, toconvert, scan, named)
+            scanned.append(path)
+    if catalog is not None:
+        # Forget directories under what we scanned that have gone away
+        stale = [path for path in scan['cached']
+                 if path not in scan['seen']
+                 and any(path == top or path.startswith(os.path.join(top, b'')) for top in scanned)]
+        fscatalog.catalog_save(catalog, scan['updates'], stale)
+    return toconvert
+
+
+def m3u_getsources(origin, pl_names, named=False, fix_synology=False):
+    # Read specified m3u playlists within dir at origin, add contents to OrderedDict and return
+    toconvert = collections.OrderedDict()
+    if os.path.isdir(origin):
+        plfilenames = []
+        for pl in pl_names:
+            if pl.endswith('.m3u'):
+                plfilenames.append(pl)
+            else:
+                plfilenames.append('%s.m3u' % pl)
+        for m3ufile in os.listdir(origin):
+            if m3ufile in plfilenames:
+                m3u_readfile(os.path.join(origin, m3ufile), toconvert, named, fix_synology)
+    else:
+        m3u_readfile(origin, toconvert, named, fix_synology)
+    return toconvert
+
+
+def rb_getsources(pl_names, named=False):
+    # Only needed for Rhythmbox playlists, so only imported for them
+    from defusedxml.ElementTree import parse as xmlparse
+    pl_etree = xmlparse("{HOME}/.local/share/rhythmbox/playlists.xml".format_map(os.environ))
+    root = pl_etree.getroot()
+    playlists = root.findall(".//playlist[@type='static']")
+
+    toconvert = collections.OrderedDict()
+    for playlist in playlists:
+        plname = playlist.attrib['name']
+        if plname in pl_names:
+            elements = playlist.findall("./location")
+            for e in elements:
+                (scheme, netloc, name) = urlparse(e.text)[0:3]
+                if (scheme != 'file' or netloc != ''):
+                    sys.stderr.write("Ignoring {uri}.".format(uri=e.text))
+                    next
+                name = unquote_to_bytes(name)
+                # With -n, may want same file in multiple locations on target,
+                # so use list.
+                if not name in toconvert:
+                    toconvert[name] = []
+                else:
+                    debug(1, "Current name: {}, playlist: {}".format(name, unquote_to_bytes(plname)))
+                addtoconvert(
+                    {
+                        'copy': False,
+                        'uri': e.text,
+                        'origin': name,
+                        'playlist': unquote_to_bytes(plname),
+                    },
+                    toconvert, named)
+    return toconvert
+
+
+def translate(tfrom, tto, items):
+    newitems = {}
+    for key, itemlist in items.items():
+        newlist = []
+        newkey = key.replace(
+            unquote_to_bytes(tfrom),
+            unquote_to_bytes(tto),
+            1)
+        for item in itemlist:
+            newitem = item.copy()
+            neworigin = item['origin'].replace(
+                unquote_to_bytes(tfrom),
+                unquote_to_bytes(tto),
+                1)
+            debug(1, "Translating %s to %s!" % (item['origin'], neworigin))
+            newitem['origin'] = neworigin
+            newlist.append(newitem)
+        newitems[newkey] = newlist
+    return newitems
@@ -0,0 +1,84 @@
+#
+# One playlist sync, start to finish: read sources, plan targets,
+# measure loudness if the profile wants it, then copy/convert.
+#
+
+import os
+import sys
+
+from .converters import profiles
+from .executor import execute
+from .planner import common_prefix, plan
+from .sources import m3u_getsources, rb_getsources, fs_getsources, translate
+from .util import debug, dformat
+
+
+class SyncError(Exception):
+    pass
+
+
+def cache_path(name):
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                        'musicmaker', name)
+
+
+def getsources(type, pl_names, origin=None, named=False, fix_synology=False, catalog=None):
+    if type == 'm3u':
+        return m3u_getsources(origin, pl_names, named, fix_synology)
+    elif type == 'rb':
+        return rb_getsources(pl_names, named)
+    elif type == 'fs':
+        return fs_getsources(origin, pl_names, named, catalog)
+    raise SyncError("Unknown playlist type '%s'" % type)
+
+
+def sync(pl_names, target, type='m3u', origin=None, profile='mp3', single=False,
+         named=False, number=False, recode=False, mangle=False, force=False,
+         translatefrom=None, translateto=None, synofix=False, catalog=None,
+         gaincache=None, batch=1, workers=(), shared=False, jobs=1, loadaware=False,
+         nice=None, ionice=None, timeout=None):
+    # Returns list of errors for items that couldn't be converted.
+    # workers are (host, port) addresses. Options are as for the CLI.
+    if not profile in profiles:
+        raise SyncError("unknown profile {profile}".format(profile=profile))
+    # xor
+    if (translatefrom is None) != (translateto is None):
+        raise SyncError("neither or both of translateto and translatefrom must be set")
+    if batch < 1:
+        raise SyncError("batch size must be at least 1")
+    if jobs < 0:
+        raise SyncError("jobs must be at least 0")
+    if timeout is not None and timeout <= 0:
+        raise SyncError("timeout must be more than 0")
+    limits = {
+        'nice': nice,
+        'ionice': ionice,
+        'timeout': timeout,
+    }
+
+    toconvert = getsources(type, pl_names, origin, named, synofix, catalog)
+    if translatefrom is not None:
+        toconvert = translate(translatefrom, translateto, toconvert)
+
+    sys.stderr.write("Target is {target}.\n".format(target=target))
+    sys.stderr.write("Common prefix is {prefix}.\n".format(prefix=common_prefix(toconvert)))
+
+    # Implicitly test whether target is a directory
+    contents = os.listdir(target)
+    if contents and not force:
+        raise SyncError("Target directory '{target}' not empty.".format(target=target))
+
+    plan(toconvert, target, profiles[profile], single, named, number, mangle, recode)
+
+    errors = []
+    if 'loudness' in profiles[profile]:
+        from .loudness import gaincache_open, set_gains
+        gaindb = gaincache_open(gaincache or cache_path('loudness.db'))
+        errors.extend(set_gains(toconvert, profiles[profile], gaindb, named and not single, limits))
+        gaindb.close()
+
+    # Debug info
+    debug(1, dformat(1, toconvert))
+
+    errors.extend(execute(toconvert, profile, batch, workers, shared, limits, jobs, loadaware))
+    return errors
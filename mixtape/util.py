@@ -0,0 +1,20 @@
+#
+# Debugging helpers shared by the rest of mixtape.
+#
+
+import pprint
+import sys
+
+DEBUG = 1
+
+def debug(level, text):
+    global DEBUG
+    if DEBUG >= level:
+        sys.stderr.write('%s\n' % text)
+
+
+def dformat(level, *args, **kwargs):
+    global DEBUG
+    if DEBUG >= level:
+        return pprint.pformat(*args, **kwargs)
+    return ""